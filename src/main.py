@@ -17,7 +17,7 @@ def _worker (id, return_dict, orderlines, edges, dists):
 	"""
 	print(f"Worker {id} is digging.")
 	solver = Solver(orderlines, edges, dists)
-	sol, cost, iterations = solver.__call__(maxtime=180)
+	sol, cost, iterations = solver.__call__(maxtime=180, processes=1)
 	return_dict[id] = iterations
 	print(f"Worker {id} ended.")
 
@@ -52,6 +52,7 @@ class Case (object):
         self.strength = strength
         self.canHold = strength
         self.busyCorners = [False, False, False]  # Used to speed up the DubePacker
+        self.index = None   # Assigned by the Solver (i.e., index in orderline.cases)
 
     def __repr__(self):
         return f"Case(position={self.position}, size=({self.sizex}, {self.sizey}, {self.sizez})," \
@@ -38,6 +38,8 @@ class OrderLine (object):
         self.pallet = None
         self.dn_edge = None
         self.nd_edge = None
+        self.id = None      # Assigned by the Solver
+        self.bit = 0        # Assigned by the Solver (i.e., 1 << id)
 
     def __hash__(self):
         """
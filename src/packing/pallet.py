@@ -45,6 +45,10 @@ class Pallet (object):
                         This is very important to understand in which order the storage
                         locations can be visited.
         :attr orderlines: <set<OrderLine>> the set of orderlines kept into this pallet.
+        :attr sortedIds: <numpy.array> the ids (assigned by the Solver) of the orderlines
+                        sorted for increasing layer (i.e., the order in which they are
+                        picked). It must be updated every time the layersMap changes.
+        :attr mask: <int> the bitmask of the orderlines kept into this pallet (see OrderLine.bit).
         """
         self.size = size
         self.maxWeight = max_weight
@@ -52,9 +56,11 @@ class Pallet (object):
         self.cases = collections.deque()
         self.layersMap = HashableDict()
         self.orderlines = set()
+        self.sortedIds = None
+        self.mask = 0
         self.weight = 0
         self.volume = 0
-        self.active = True       # Used only by the sequential procedure
+        self.active = True       # False once merged into another pallet
 
     def __hash__ (self):
         """
@@ -15,15 +15,25 @@ Author' contact: mattianeroni93@gmail.com
 %%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
 """
 import collections
+import functools
 import operator
 import random
 import itertools
+import multiprocessing
+import os
 import matplotlib.pyplot as plt
 import time
-from math import log
+import numpy as np
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
 
 from packing import dubePacker
 from packing import Pallet
+from packing import Case
+from packing.pallet import HashableDict
 import utils
 
 
@@ -35,6 +45,11 @@ import utils
 GREEDY_BETA = 0.9999
 
 
+# The maximum number of pallets whose distance walked is cached by
+# each Solver (see Solver.getCost).
+COST_CACHE_SIZE = 100000
+
+
 def _bra (array, beta):
     """
     This method carry out a biased-randomised selection over a certain list.
@@ -50,13 +65,218 @@ def _bra (array, beta):
 
     """
     arr = list(array)
-    L = len(array)
-    for _ in range(L):
-        idx = int(log(random.random(), 1.0 - beta)) % len(arr)
+    L = len(arr)
+    # All the positions are drawn at once, the i-th is taken modulo the
+    # number of options still in list at the i-th iteration.
+    # NOTE: a geometric distribution with success probability beta (shifted to
+    # start from 0) is exactly the quasi-geometric f(x) above.
+    positions = (np.random.geometric(beta, L) - 1) % np.arange(L, 0, -1)
+    for idx in positions.tolist():
         yield arr.pop(idx)
 
 
 
+if njit is not None:
+    @njit(cache=True)
+    def _tour_cost (locs, dists):
+        """
+        This method calculates the distance walked by the picker to visit a
+        sequence of locations, starting from and going back to the depot.
+        It is compiled by Numba and the compiled version is cached on disk.
+
+        :param locs: <numpy.array> The locations to visit in the order they are visited.
+        :param dists: <numpy.array> The matrix of distances between locations.
+        :return: The distance walked.
+
+        """
+        total = dists[0, locs[0]] + dists[locs[-1], 0]
+        for i in range(len(locs) - 1):
+            total += dists[locs[i], locs[i + 1]]
+        return total
+else:
+    def _tour_cost (locs, dists):
+        """
+        Same as above, used when Numba is not available.
+        """
+        return dists[0, locs[0]] + dists[locs[-1], 0] + dists[locs[:-1], locs[1:]].sum()
+
+
+# The maximum number of packings cached by _cached_pack.
+# NOTE: on the real instances an entry can take up to ~80 KB (e.g., tests/test18.csv),
+# so the cache is kept small enough to stay below ~100 MB for each process.
+PACK_CACHE_SIZE = 1024
+
+
+@functools.lru_cache(maxsize=PACK_CACHE_SIZE)
+def _cached_pack (host_sig, hosted_sig, layers_sig, pallet_size, max_weight):
+    """
+    This method runs the packer on a throwaway pallet rebuilt from the signatures
+    computed by _pack, and it returns the result in a compact form that does not
+    refer to any actual Case or OrderLine.
+    In this way, the same merging attempt (which recur constantly during the
+    multistart) is solved by the DubePacker only once.
+
+    :param host_sig: <tuple> The signature of the cases already in the hosting pallet.
+    :param hosted_sig: <tuple> The signature of the cases to place.
+    :param layers_sig: <tuple> The layersMap of the hosting pallet.
+    :param pallet_size: <tuple<int>> Pallets size
+    :param max_weight: <int> Pallets max weight
+    :return: <tuple> (i) True if the packing has been successful and False otherwise,
+            (ii) for each packed case the index of the case it comes from and the
+            attributes it assumed during the packing, (iii) the new layersMap.
+
+    """
+    pallet = Pallet(pallet_size, max_weight)
+    for source, (sizex, sizey, sizez, x, y, z, rotated, strength, canHold, busyCorners, line, code) in enumerate(host_sig):
+        case = Case(line, code, sizex, sizey, sizez, 0, strength)
+        case.x, case.y, case.z = x, y, z
+        case.rotated, case.canHold, case.busyCorners = rotated, canHold, list(busyCorners)
+        case.source = source
+        pallet.cases.append(case)
+    pallet.layersMap.update(layers_sig)
+
+    hosted = Pallet(pallet_size, max_weight)
+    for source, (sizex, sizey, sizez, rotated, strength, line, code) in enumerate(hosted_sig, len(host_sig)):
+        case = Case(line, code, sizex, sizey, sizez, 0, strength)
+        case.rotated = rotated
+        case.source = source
+        hosted.cases.append(case)
+
+    done, packedCases, layersMap = dubePacker(pallet, hosted)
+    packedCases = tuple((c.source, c.x, c.y, c.z, c.sizex, c.sizey, c.rotated, c.canHold, tuple(c.busyCorners))
+                        for c in packedCases)
+    return done, packedCases, tuple(layersMap.items())
+
+
+
+def _pack (pallet, hosted):
+    """
+    This method has the same interface of the DubePacker, but the result of the
+    packing is cached on a signature of the cases involved rather than on the
+    pallets themselves. The signature keeps the order in which cases are stored,
+    because it affects the result of the packer. Orderlines and codes are replaced
+    by their local index, so that pallets containing the same cases hit the cache
+    even if they are different objects.
+    NOTE: repeated attempts of merging the same couple of pallets during a single
+    solution are skipped by the heuristic by means of the pallets masks.
+
+    :param pallet: <Pallet> The pallet in which cases must be placed.
+    :param hosted: <Pallet>/<OrderLine> The pallet or the orderline whose cases must be placed.
+    :return: <tuple> The same result of the DubePacker.
+
+    """
+    lines, codes = {}, {}
+    host_sig = tuple((c.sizex, c.sizey, c.sizez, c.x, c.y, c.z, c.rotated, c.strength, c.canHold, tuple(c.busyCorners),
+                      lines.setdefault(c.orderline, len(lines)), codes.setdefault(c.code, len(codes)))
+                     for c in pallet.cases)
+    layers_sig = tuple((lines.setdefault(line, len(lines)), layer) for line, layer in pallet.layersMap.items())
+    hosted_sig = tuple((c.sizex, c.sizey, c.sizez, c.rotated, c.strength,
+                        lines.setdefault(c.orderline, len(lines)), codes.setdefault(c.code, len(codes)))
+                       for c in hosted.cases)
+
+    done, packedCases, layers = _cached_pack(host_sig, hosted_sig, layers_sig, pallet.size, pallet.maxWeight)
+
+    # Rebuild the packing from the actual cases
+    sources = tuple(pallet.cases) + tuple(hosted.cases)
+    lines = tuple(lines)
+    packed = collections.deque()
+    for source, x, y, z, sizex, sizey, rotated, canHold, busyCorners in packedCases:
+        case = sources[source].__copy__()
+        case.x, case.y, case.z = x, y, z
+        case.sizex, case.sizey, case.rotated = sizex, sizey, rotated
+        case.canHold, case.busyCorners = canHold, list(busyCorners)
+        packed.append(case)
+    layersMap = HashableDict((lines[line], layer) for line, layer in layers)
+    return done, packed, layersMap
+
+
+
+def _sort_orderlines (pallet):
+    """
+    This method updates the ids of the orderlines of a pallet in the order they
+    must be picked -- i.e., for increasing layer.
+    Orderlines on the same layer keep the order they have in the layersMap.
+    It must be called every time the layersMap of the pallet changes.
+
+    :param pallet: <Pallet> The pallet.
+
+    """
+    layersMap = pallet.layersMap
+    pallet.sortedIds = np.fromiter((o.id for o in sorted(layersMap, key=layersMap.__getitem__)),
+                                   dtype=np.int32, count=len(layersMap))
+
+
+
+# The solver and the best cost known by each process of the
+# parallel multistart (see Solver.__call__).
+_worker_solver = None
+_worker_bestcost = None
+
+
+def _init_worker (solver, bestcost):
+    """
+    This method initialises a process of the parallel multistart.
+    The random generators are seeded again, otherwise forked processes would
+    all generate the same solutions.
+
+    :param solver: <Solver> The solver.
+    :param bestcost: The cost of the starting solution.
+
+    """
+    global _worker_solver, _worker_bestcost
+    _worker_solver, _worker_bestcost = solver, bestcost
+    random.seed()
+    np.random.seed()
+
+
+def _available_cpus ():
+    """
+    This method returns the number of CPUs the current process may use, which
+    can be less than the CPUs of the machine (e.g., under affinity or cgroups limits).
+    """
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return multiprocessing.cpu_count()
+
+
+def _compact (solution):
+    """
+    This method describes a solution by the ids of its orderlines and the placement
+    of its cases, so that the processes of the parallel multistart can send it back
+    without pickling cases and orderlines (see Solver._rebuild).
+
+    :param solution: The set of pallets.
+    :return: <tuple> For each pallet, (i) the orderline id, the index in the orderline
+            and the attributes assumed during the packing of each case, and (ii) the
+            layersMap by orderline id.
+
+    """
+    return tuple((tuple((c.orderline.id, c.index, c.x, c.y, c.z, c.sizex, c.sizey, c.rotated, c.canHold,
+                         tuple(c.busyCorners)) for c in pallet.cases),
+                  tuple((line.id, layer) for line, layer in pallet.layersMap.items()))
+                 for pallet in solution)
+
+
+def _multistart_task (beta):
+    """
+    This method generates a new solution in a process of the parallel multistart.
+    The solution is sent back only if it improves the best found so far by the
+    process, because it cannot improve the overall best otherwise.
+
+    :param beta: <float> The parameter of the quasi-geometric distribution.
+    :return: <tuple> The cost of the new solution and the compact solution (or None).
+
+    """
+    global _worker_bestcost
+    newsol = _worker_solver._heuristic_random(beta)
+    newcost = _worker_solver.getCost(newsol, _worker_solver.dists)
+    if newcost < _worker_bestcost:
+        _worker_bestcost = newcost
+        return newcost, _compact(newsol)
+    return newcost, None
+
+
+
 class Solver (object):
     """
     An instance of this class represents a solver for the
@@ -70,18 +290,73 @@ class Solver (object):
         :attr dists: <numpy.array> The matrix of distances between locations.
         :attr pallet_size: <tuple<int>> Pallets size
         :attr pallet_max_weight: <int> Pallets max weight
-        :attr history: The evelution of the best solution during the iterations
-                        of the algorithm.
+        :attr history: <numpy.array> The evelution of the best solution during the iterations
+                        of the algorithm. Only the first _history_size elements are used,
+                        the array is doubled when full.
+        :attr _savingsList: <tuple<Edge>> The edges sorted for decreasing saving.
+                        Savings never change, so the list is sorted only once here.
+                        The edges whose orderlines exceed the weight or the volume of a
+                        pallet already by themselves are excluded, because pallets can
+                        only grow during the merging process.
+        :attr _edge_ends: <tuple<tuple<int>>> The ids of the origin and the end
+                        orderlines of each edge in _savingsList.
+        :attr _dummy_packings: <tuple<tuple>> The cases and the layersMap of the
+                        pallet made by each orderline alone. They are the same for every
+                        solution, so the packing is made only once here.
+        :attr _line_locations: <numpy.array> The location of each orderline,
+                        indexed by the id of the orderline.
+        :attr _cost_cache: <OrderedDict> LRU cache of the distance walked to construct
+                        each pallet on the dists of this solver, by sortedIds.
 
         NOTE that to each OrderLine is supposed to be associated one and only
         one location.
+        NOTE that an id is assigned to each OrderLine (i.e., its index in orderlines),
+        and the corresponding bit used in the masks of the pallets. Each Case gets
+        its index in the cases of its OrderLine. Since the same orderlines may be
+        shared by different solvers, ids are assigned again every time this solver
+        builds a solution (see _stamp).
         """
         self.orderlines = orderlines
         self.edges = edges
         self.dists = dists
         self.pallet_size = pallet_size
         self.pallet_max_weight = pallet_max_weight
-        self.history = collections.deque()
+        self.history = np.empty(1024, dtype=np.float64)
+        self._history_size = 0
+        self._cost_cache = collections.OrderedDict()
+        self._stamp()
+        self._line_locations = np.array([orderline.location for orderline in orderlines], dtype=np.int32)
+
+        savingsList = sorted(edges, key=operator.attrgetter("saving"), reverse=True)
+        weights = np.array([orderline.weight for orderline in orderlines], dtype=np.float64)
+        volumes = np.array([orderline.volume for orderline in orderlines], dtype=np.float64)
+        origins = np.array([edge.origin.id for edge in savingsList], dtype=np.int64)
+        ends = np.array([edge.end.id for edge in savingsList], dtype=np.int64)
+        feasible = (weights[origins] + weights[ends] <= pallet_max_weight) & \
+                   (volumes[origins] + volumes[ends] <= functools.reduce(operator.mul, pallet_size, 1))
+        self._savingsList = tuple(itertools.compress(savingsList, feasible.tolist()))
+        self._edge_ends = tuple((edge.origin.id, edge.end.id) for edge in self._savingsList)
+
+        dummy_packings = []
+        for orderline in orderlines:
+            done, packedCases, layersMap = _pack(Pallet(pallet_size, pallet_max_weight), orderline)
+            assert done == True
+            dummy_packings.append((packedCases, layersMap))
+        self._dummy_packings = tuple(dummy_packings)
+
+
+    def _stamp (self):
+        """
+        This method assigns to each OrderLine its id and its bit, and to each
+        Case its index in the cases of its OrderLine.
+        It must be called before building a solution, because another solver
+        built on the same orderlines may have assigned different ids.
+        """
+        for i, orderline in enumerate(self.orderlines):
+            orderline.id = i
+            orderline.bit = 1 << i
+            for index, case in enumerate(orderline.cases):
+                case.index = index
 
 
     def plot (self):
@@ -89,12 +364,22 @@ class Solver (object):
         This method plots the evolution of the current best solution during the
         execution of the algorithm.
         """
-        plt.plot(self.history)
+        plt.plot(self.history[:self._history_size])
         plt.xlabel("Iterations")
         plt.ylabel("Total Distance")
         plt.show()
 
 
+    def _save (self, cost):
+        """
+        This method saves the cost of the current best solution in the history.
+        """
+        if self._history_size == len(self.history):
+            self.history = np.resize(self.history, 2 * len(self.history))
+        self.history[self._history_size] = cost
+        self._history_size += 1
+
+
     def heuristic (self, beta):
         """
          This method provides a single solution to the problem.
@@ -104,71 +389,167 @@ class Solver (object):
          :return: The resulting list of pallets.
 
         """
+        if beta == GREEDY_BETA:
+            return self._heuristic_greedy()
+        return self._heuristic_random(beta)
+
+
+    def _heuristic_greedy (self):
+        """
+         This method provides the greedy solution to the problem -- i.e., the
+         edges are merged in the order of the savings list.
+         It is the same of heuristic(GREEDY_BETA) without the biased randomised selection.
+
+         :return: The resulting list of pallets.
+
+        """
+        return self._heuristic(self._edge_ends)
+
+
+    def _heuristic_random (self, beta):
+        """
+         This method provides a single solution to the problem by picking the
+         edges with a biased randomised selection.
+
+         :param beta: <float> The parameter of the quasi-geometric distribution
+                    used by the biased randomised selection.
+         :return: The resulting list of pallets.
+
+        """
+        return self._heuristic(_bra(self._edge_ends, beta))
+
+
+    def _heuristic (self, savingsList):
+        """
+         This method carries out the merging process shared by the greedy and the
+         randomised heuristic.
+
+         :param savingsList: <iterable<tuple<int>>> The ids of the orderlines connected
+                    by each edge, in the order the edges must be tried.
+         :return: The resulting list of pallets.
+
+        """
+        # Assign the ids of this solver to the orderlines
+        self._stamp()
         # Get pallets characteristics on stack
         pallet_size, pallet_max_weight = self.pallet_size, self.pallet_max_weight
+        maxVolume, maxWeight = functools.reduce(operator.mul, pallet_size, 1), pallet_max_weight
         # Build a dummy solution
-        palletsList = []
-        for orderline in self.orderlines:
+        # NOTE: pallet_of keeps track of the pallet of each orderline (by id).
+        # NOTE: palletsList is a dict by id so that merged pallets are removed in O(1),
+        # pallets cannot be kept in a set because their hash changes with the layersMap.
+        # NOTE: failed keeps the couples of pallets that cannot be merged in any direction,
+        # as the union of their masks. While both pallets exist, no other couple has the
+        # same union, and a pallet with a given mask cannot change, so it is an exact key.
+        palletsList = {}
+        pallet_of = [None] * len(self.orderlines)
+        failed = set()
+        for orderline, (packedCases, layersMap) in zip(self.orderlines, self._dummy_packings):
             p = Pallet(pallet_size, pallet_max_weight)
-            done, packedCases, layersMap = dubePacker(p, orderline)
-            assert done == True
-            p.cases, p.layersMap = packedCases, layersMap
+            p.cases, p.layersMap = collections.deque(packedCases), HashableDict(layersMap)
+            _sort_orderlines(p)
             p.weight = orderline.weight
             p.volume = orderline.volume
             orderline.pallet = p
+            pallet_of[orderline.id] = p
             p.orderlines.add(orderline)
-            palletsList.append(p)
-
-        # Generate the savings list
-        savingsList = sorted(self.edges, key=operator.attrgetter("saving"), reverse=True)
+            p.mask = orderline.bit
+            palletsList[id(p)] = p
 
         # Merging process
-        for edge in _bra(savingsList, beta):
+        for origin, end in savingsList:
             # Picks an edge and read the pallet it could connect
-            host = edge.origin.pallet
-            hosted = edge.end.pallet
+            host = pallet_of[origin]
+            hosted = pallet_of[end]
             # The the hosting pallet and the hosted pallet are the same the procedure
-            # interrupts and goes to the next edge
-            if host == hosted:
+            # interrupts and goes to the next edge.
+            # NOTE: the pallet of each orderline is updated at every merge, so it already
+            # works as a union-find with full path compression: the identity check is
+            # enough to skip the edges inside the same pallet before any other control.
+            if host is hosted:
                 continue
             # Control the volumetric lower bound
-            if host.volume + hosted.volume > host.maxVolume:
+            if host.volume + hosted.volume > maxVolume:
                 continue
             # Control the weight lower bound
-            if host.weight + hosted.weight > host.maxWeight:
+            if host.weight + hosted.weight > maxWeight:
+                continue
+            # Skip the couples already tried
+            mask = host.mask | hosted.mask
+            if mask in failed:
                 continue
             # Try merging
-            done, packedCases, layersMap = dubePacker(host, hosted)
+            done, packedCases, layersMap = _pack(host, hosted)
             if done:
                 host.cases = packedCases
                 host.layersMap = layersMap
+                _sort_orderlines(host)
                 host.weight += hosted.weight
                 host.volume += hosted.volume
                 host.orderlines.update(hosted.orderlines)
-                palletsList.remove(hosted)
+                host.mask = mask
+                hosted.active = False
+                del palletsList[id(hosted)]
                 for line in hosted.orderlines:
                     line.pallet = host
+                    pallet_of[line.id] = host
                 continue
             # Eventually try a merging using the inverse of the edge -- i.e., switching
             # the hositng pallet with the hosted pallet.
             host, hosted = hosted, host
-            done, packedCases, layersMap = dubePacker(host, hosted)
+            done, packedCases, layersMap = _pack(host, hosted)
             if done:
                 host.cases = packedCases
                 host.layersMap = layersMap
+                _sort_orderlines(host)
                 host.weight += hosted.weight
                 host.volume += hosted.volume
                 host.orderlines.update(hosted.orderlines)
-                palletsList.remove(hosted)
+                host.mask = mask
+                hosted.active = False
+                del palletsList[id(hosted)]
                 for line in hosted.orderlines:
                     line.pallet = host
+                    pallet_of[line.id] = host
+                continue
+            failed.add(mask)
 
         # At the end, return the palletsList
-        return palletsList
+        return list(palletsList.values())
+
+
+    def _rebuild (self, compact):
+        """
+        This method rebuilds a solution sent back by a process of the parallel
+        multistart (see _compact) on the orderlines of this solver.
 
+        :param compact: <tuple> The compact description of the solution.
+        :return: The resulting list of pallets.
 
-    @staticmethod
-    def getCost(solution, dists):
+        """
+        orderlines = self.orderlines
+        solution = []
+        for cases, layers in compact:
+            p = Pallet(self.pallet_size, self.pallet_max_weight)
+            for line, index, x, y, z, sizex, sizey, rotated, canHold, busyCorners in cases:
+                case = orderlines[line].cases[index].__copy__()
+                case.x, case.y, case.z = x, y, z
+                case.sizex, case.sizey, case.rotated = sizex, sizey, rotated
+                case.canHold, case.busyCorners = canHold, list(busyCorners)
+                p.cases.append(case)
+            p.layersMap = HashableDict((orderlines[line], layer) for line, layer in layers)
+            _sort_orderlines(p)
+            for orderline in p.layersMap:
+                p.weight += orderline.weight
+                p.volume += orderline.volume
+                p.orderlines.add(orderline)
+                p.mask |= orderline.bit
+                orderline.pallet = p
+            solution.append(p)
+        return solution
+
+
+    def getCost(self, solution, dists):
         """
         Given a solution (a set of pallets) and the matrix of distances, this method calculates
         the cost of the solution -- i.e., the distance walked by the picker to collect all
@@ -179,22 +560,42 @@ class Solver (object):
         :return: The distance walked by the picker to construct all pallets.
 
         """
+        line_locations = self._line_locations
+        # The cache is only valid for the dists of this solver
+        if dists is not self.dists:
+            return sum(_tour_cost(line_locations[pallet.sortedIds], dists) for pallet in solution)
+
+        cost_cache = self._cost_cache
         total = 0
         for pallet in solution:
-            sort_orderlines = tuple(dict(sorted(pallet.layersMap.items(), key=operator.itemgetter(1))).keys())
-            total += dists[0, sort_orderlines[0].location] + dists[sort_orderlines[-1].location, 0]
-            total += sum(dists[i.location, j.location] for i, j in zip(sort_orderlines[:-1], sort_orderlines[1:]))
+            key = pallet.sortedIds.tobytes()
+            cost = cost_cache.get(key)
+            if cost is None:
+                cost = _tour_cost(line_locations[pallet.sortedIds], dists)
+                cost_cache[key] = cost
+                if len(cost_cache) > COST_CACHE_SIZE:
+                    cost_cache.popitem(last=False)
+            else:
+                cost_cache.move_to_end(key)
+            total += cost
         return total
 
 
-    def __call__ (self, maxtime, betarange=(0.1, 0.3)):
+    def __call__ (self, maxtime, betarange=(0.1, 0.3), processes=None):
         """
          This method executes many times the heuristic method generating many
          different solutions until the available time (i.e., maxtime) is not exceeded.
          Every time a new solution is generated, it is compared with the best found so
          far, and, if better, the best solution is temporarily updated.
 
+         The solutions are generated in parallel by a pool of processes. Each process
+         sends back the cost of each solution, and a compact description of the solution
+         only when it improves the best found so far by the process. The best solution is
+         rebuilt on the orderlines of the solver at the end.
+
          :param maxtime: <time>/<float> The available computational time.
+         :param processes: <int> The number of processes (by default the number of CPUs available).
+                    With one process everything is done in the current process.
          :return: <tuple> It returns (i) the best solution found (a set of pallets),
                     (ii) the cost of the best solution (the distance made by the picker),
                     (iii) the number of solutions explored by the algorithm in the
@@ -202,17 +603,43 @@ class Solver (object):
 
         """
         # Move useful data to the stack
-        heuristic = self.heuristic
+        heuristic = self._heuristic_random
         getCost = self.getCost
         dists = self.dists
         orderlines = self.orderlines
-        save = self.history.append
+        save = self._save
         # Generate a starting solution
-        best = heuristic(GREEDY_BETA)
+        best = self._heuristic_greedy()
         bestcost = getCost(best, dists)
         # Start a multistart iterated local search
         iterations = 0
         start = time.time()
+        processes = processes or _available_cpus()
+        if processes > 1:
+            compact = None
+            with multiprocessing.Pool(processes, _init_worker, (self, bestcost)) as pool:
+                # Keep a couple of tasks waiting for each process
+                pending = collections.deque(pool.apply_async(_multistart_task, (random.uniform(*betarange),))
+                                            for _ in range(2 * processes))
+                while time.time() - start < maxtime:
+                    # Do not wait for a solution beyond the available time
+                    try:
+                        newcost, newsol = pending.popleft().get(timeout=max(0.0, maxtime - (time.time() - start)))
+                    except multiprocessing.TimeoutError:
+                        break
+                    iterations += 1
+                    pending.append(pool.apply_async(_multistart_task, (random.uniform(*betarange),)))
+
+                    # Eventually update the best
+                    if newsol is not None and newcost < bestcost:
+                        compact, bestcost = newsol, newcost
+                    # Save the current best
+                    save(bestcost)
+
+            if compact is not None:
+                best = self._rebuild(compact)
+            return best, bestcost, iterations
+
         while time.time() - start < maxtime:
             iterations += 1
             # Generate a new solution
@@ -237,18 +664,19 @@ class Solver (object):
         This is used to compare the proposed procedure in the __call__ method
         with a different approach where routing and packing are not solved together.
         """
+        self._stamp()
         pallet_size, pallet_max_weight = self.pallet_size, self.pallet_max_weight
         palletsList = []
         # First build a pallet for each orderline (dummy solution)
-        for orderline in self.orderlines:
+        for orderline, (packedCases, layersMap) in zip(self.orderlines, self._dummy_packings):
             p = Pallet(pallet_size, pallet_max_weight)
-            done, packedCases, layersMap = dubePacker(p, orderline)
-            assert done == True
-            p.cases, p.layersMap = packedCases, layersMap
+            p.cases, p.layersMap = collections.deque(packedCases), HashableDict(layersMap)
+            _sort_orderlines(p)
             p.weight = orderline.weight
             p.volume = orderline.volume
             orderline.pallet = p
             p.orderlines.add(orderline)
+            p.mask = orderline.bit
             palletsList.append(p)
 
         # Sort palletsList for decreasing strength
@@ -265,13 +693,15 @@ class Solver (object):
                 if iPallet.weight + jPallet.weight > iPallet.maxWeight:
                     continue
                 # Try merging
-                done, packedCases, layersMap = dubePacker(iPallet, jPallet)
+                done, packedCases, layersMap = _pack(iPallet, jPallet)
                 if done:
                     iPallet.cases = packedCases
                     iPallet.layersMap = layersMap
+                    _sort_orderlines(iPallet)
                     iPallet.weight += jPallet.weight
                     iPallet.volume += jPallet.volume
                     iPallet.orderlines.update(jPallet.orderlines)
+                    iPallet.mask |= jPallet.mask
                     jPallet.active = False
                     for line in jPallet.orderlines:
                         line.pallet = iPallet